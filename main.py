@@ -4,96 +4,149 @@
 import os
 import sys
 import random
+from functools import lru_cache
 import pygame as pg
 
 # constants
 TILES_PER_SIDE = 4
+# FPS sets the maximum time waited for an event before the game loop runs again
 FPS = 30
 # SHUFFLE sets the minimum number of random moves when setting the board
 SHUFFLE = 40
+# the blank is the last tile, and sits at the last index when the puzzle is solved
+BLANK = TILES_PER_SIDE * TILES_PER_SIDE - 1
+# the board state packs each tile number in TILE_BITS bits of a single integer, the tile at index i being at bit TILE_BITS * i
+TILE_BITS = max(BLANK.bit_length(), 1)
+TILE_MASK = (1 << TILE_BITS) - 1
+SOLVED_STATE = sum(tile << (TILE_BITS * tile) for tile in range(TILES_PER_SIDE * TILES_PER_SIDE))
+# STATE_CACHE_SIZE sets the maximum number of board states whose heuristics are kept in memory
+STATE_CACHE_SIZE = 1 << 20
 
 # colors
 SILVER = (192, 192, 192)
 GREY = (128, 128, 128)
 
 
+def compute_valid_moves(idx):
+    """Return the tuple of the indexes next to index idx, i.e. the tiles able to move when the blank is at idx."""
+
+    valid_moves = []
+    row, col = divmod(idx, TILES_PER_SIDE)
+
+    if col - 1 >= 0:
+        valid_moves.append(idx - 1)
+    if col + 1 < TILES_PER_SIDE:
+        valid_moves.append(idx + 1)
+    if row - 1 >= 0:
+        valid_moves.append(idx - TILES_PER_SIDE)
+    if row + 1 < TILES_PER_SIDE:
+        valid_moves.append(idx + TILES_PER_SIDE)
+
+    return tuple(valid_moves)
+
+
+# valid moves for each position of the blank, computed once as TILES_PER_SIDE never changes
+VALID_MOVES = [compute_valid_moves(idx) for idx in range(TILES_PER_SIDE * TILES_PER_SIDE)]
+VALID_MOVES_SETS = [frozenset(valid_moves) for valid_moves in VALID_MOVES]
+# valid moves which do not undo the previous move, keyed by (blank index, previous blank index)
+SHUFFLE_MOVES = {(idx, previous_idx): tuple(move for move in VALID_MOVES[idx] if move != previous_idx)
+                 for idx in range(TILES_PER_SIDE * TILES_PER_SIDE) for previous_idx in VALID_MOVES[idx] + (idx,)}
+# distance between the index of each tile and its solved index, keyed by [tile][idx]
+DISTANCES = [[abs(tile % TILES_PER_SIDE - idx % TILES_PER_SIDE) + abs(tile // TILES_PER_SIDE - idx // TILES_PER_SIDE)
+              for idx in range(TILES_PER_SIDE * TILES_PER_SIDE)] for tile in range(TILES_PER_SIDE * TILES_PER_SIDE)]
+
+
+@lru_cache(maxsize=STATE_CACHE_SIZE)
+def manhattan_distance(state):
+    """Return the sum of the distances between each tile and its solved position for a packed board state, ignoring the blank.
+    Results are cached by state, so that a solver or a hint feature revisiting states does not recompute them."""
+
+    distance = 0
+    for idx in range(TILES_PER_SIDE * TILES_PER_SIDE):
+        tile = (state >> (TILE_BITS * idx)) & TILE_MASK
+        if tile != BLANK:
+            distance += DISTANCES[tile][idx]
+
+    return distance
+
+
 class Board():
     """The Board object simulates a set of puzzle pieces, one of which is
     a blank."""
 
     def __init__(self):
-        """The Board is represented by a dict which associates coordinates (tuples of x and y) as keys and numbered tiles (integers) as values.
-        On initialization, the tiles are randomly shuffled a minimum SHUFFLE times. The Board keeps track of the blank tile's coordinates to manage movements."""
+        """The Board is represented by a single integer state packing the numbered tiles, indexed by row * TILES_PER_SIDE + col.
+        On initialization, the tiles are randomly shuffled a minimum SHUFFLE times. The Board keeps track of the blank tile's index to manage movements."""
 
-        self.tiles = dict()
-        for col in range(TILES_PER_SIDE):
-            for row in range(TILES_PER_SIDE):
-                self.tiles[(col, row)] = row * TILES_PER_SIDE + col
-
-        self.blank_xy = (TILES_PER_SIDE - 1, TILES_PER_SIDE - 1)
+        self.state = SOLVED_STATE
+        self.blank_idx = BLANK
+        self.changed_tiles = []
+        self.rng = random.Random()
         self.shuffle()
 
     def get_valid_moves(self):
-        """Return the list of the tiles able to move because they are next to the blank."""
-
-        valid_moves = []
-
-        if self.blank_xy[0] - 1 >= 0:
-            valid_moves.append((self.blank_xy[0] - 1, self.blank_xy[1]))
-        if self.blank_xy[0] + 1 < TILES_PER_SIDE:
-            valid_moves.append((self.blank_xy[0] + 1, self.blank_xy[1]))
-        if self.blank_xy[1] - 1 >= 0:
-            valid_moves.append((self.blank_xy[0], self.blank_xy[1] - 1))
-        if self.blank_xy[1] + 1 < TILES_PER_SIDE:
-            valid_moves.append((self.blank_xy[0], self.blank_xy[1] + 1))
+        """Return the tuple of the indexes of the tiles able to move because they are next to the blank."""
 
-        return valid_moves
+        return VALID_MOVES[self.blank_idx]
 
-    def move_tile(self, xy):
-        """Swap the positions of the tile at xy coordinates and the blank."""
+    def move_tile(self, idx):
+        """Swap the positions of the tile at index idx and the blank, and record both indexes as changed."""
 
-        tile = self.tiles[xy]
-        self.tiles[xy] = TILES_PER_SIDE * TILES_PER_SIDE - 1
-        self.tiles[self.blank_xy] = tile
-        self.blank_xy = xy
+        tile_shift = TILE_BITS * idx
+        blank_shift = TILE_BITS * self.blank_idx
+        # xor-ing both fields with tile ^ BLANK turns the tile into the blank and the blank into the tile
+        diff = ((self.state >> tile_shift) & TILE_MASK) ^ BLANK
+        self.state ^= (diff << tile_shift) | (diff << blank_shift)
+        self.changed_tiles.append(idx)
+        self.changed_tiles.append(self.blank_idx)
+        self.blank_idx = idx
 
     def shuffle(self):
         """Make at least SHUFFLE random moves then continue until the blank is at the bottom right position. At each step, check that you do not undo the previous move."""
 
-        previous_blank_xy = self.blank_xy
+        # local names avoid repeated global and attribute lookups in the loop
+        choice = self.rng.choice
+        shuffle_moves = SHUFFLE_MOVES
+        move_tile = self.move_tile
+
+        previous_blank_idx = self.blank_idx
         moves_nb = 0
-        while moves_nb < SHUFFLE or self.blank_xy != (TILES_PER_SIDE - 1, TILES_PER_SIDE - 1):
-            valid_moves = self.get_valid_moves()
-            if previous_blank_xy in valid_moves:
-                valid_moves.pop(valid_moves.index(previous_blank_xy))
-            previous_blank_xy = self.blank_xy
-            move = random.choice(valid_moves)
-            self.move_tile(move)
+        while moves_nb < SHUFFLE or self.blank_idx != BLANK:
+            valid_moves = shuffle_moves[(self.blank_idx, previous_blank_idx)]
+            previous_blank_idx = self.blank_idx
+            move_tile(choice(valid_moves))
             moves_nb += 1
 
     def is_game_won(self):
         """Return True if the tiles are in their original order."""
 
-        for col in range(TILES_PER_SIDE):
-            for row in range(TILES_PER_SIDE):
-                if self.tiles[(col, row)] != ((row * TILES_PER_SIDE) + col):
-                    return False
+        return self.state == SOLVED_STATE
+
+    def get_manhattan_distance(self):
+        """Return the Manhattan distance of the board to its solved state, an estimate of the number of moves left."""
+
+        return manhattan_distance(self.state)
 
-        return True
+    def get_tiles(self):
+        """Unpack the state and return the list of the numbered tiles, indexed by row * TILES_PER_SIDE + col."""
+
+        return [(self.state >> (TILE_BITS * idx)) & TILE_MASK for idx in range(TILES_PER_SIDE * TILES_PER_SIDE)]
 
 
 class Game():
     """The Game object wraps most of the program's functionalities."""
 
     def __init__(self):
-        """- Initialize pygame;
+        """- Initialize the pygame modules used by the game, display and font only;
         - load the image for the puzzle, calculate the dimensions for the window then create a pygame display surface;
         - do some more pygame initialization stuff;
         - create a Board object;
         - create a list of sprites for rendering the tiles;
+        - pre-render the background, the grid, the intro screen and the game over overlay;
         - set some variables to control the program's flow."""
 
-        pg.init()
+        pg.display.init()
+        pg.font.init()
         self.image = pg.image.load(os.path.join("img", "01.png"))
         image_rect = self.image.get_rect()
         self.screen_width = image_rect.width
@@ -102,44 +155,91 @@ class Game():
         self.tile_height = self.screen_height // TILES_PER_SIDE
 
         self.screen = pg.display.set_mode((self.screen_width, self.screen_height))
-        self.image.convert()
+        # convert the image to the display's pixel format once so that blitting its tiles is a plain copy
+        if self.image.get_flags() & pg.SRCALPHA:
+            self.image = self.image.convert_alpha()
+        else:
+            self.image = self.image.convert()
         pg.display.set_caption("PygSlidePuzzle")
-        self.fps_clock = pg.time.Clock()
-        self.font = pg.font.Font(None, 24)
+        # only queue the events the game handles, mouse motion alone would otherwise flood the queue
+        pg.event.set_blocked(None)
+        pg.event.set_allowed([pg.QUIT, pg.KEYDOWN, pg.MOUSEBUTTONDOWN, pg.VIDEOEXPOSE])
+        # fonts keyed by size, rendered texts keyed by (text, size, color)
+        self.fonts = dict()
+        self.text_surfaces = dict()
 
         self.board = Board()
         self.tile_sprites = self.init_tile_sprites()
+        self.tile_images = [tile_sprite.image for tile_sprite in self.tile_sprites]
+        self.background = pg.Surface((self.screen_width, self.screen_height)).convert()
+        self.background.fill(GREY)
+        self.grid_surface = pg.Surface((self.screen_width, self.screen_height)).convert()
+        self.grid_surface.set_colorkey(SILVER)
+        self.grid_surface.fill(SILVER)
+        self.draw_grid(self.grid_surface)
+        self.tile_rects = [pg.Rect(col * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height)
+                           for row in range(TILES_PER_SIDE) for col in range(TILES_PER_SIDE)]
+        self.tile_positions = [rect.topleft for rect in self.tile_rects]
+        self.grid_cells = [self.grid_surface.subsurface(rect) for rect in self.tile_rects]
+        self.intro_surface = self.init_intro_surface()
+        self.game_over_overlay = self.init_game_over_overlay()
 
         self.running = True
+        self.dirty = True
+        self.full_redraw = True
+        self.dirty_rects = []
         self.do_render = True
         self.command = None
         self.game_won = False
 
     def init_tile_sprites(self):
-        """Use pygame functionalities to create and return a list of sprites on which portions of the main image are blitted, plus a sprite for the blank."""
+        """Use pygame functionalities to create and return a list of sprites whose images are subsurfaces of the main image, plus a sprite for the blank.
+        Subsurfaces share the main image's pixels, so no pixel data is copied."""
 
         tile_sprites =[]
         for i in range(TILES_PER_SIDE * TILES_PER_SIDE - 1):
             tile_sprite = pg.sprite.Sprite()
-            tile_sprite.image = pg.Surface((self.tile_width, self.tile_height))
-            tile_sprite.rect = tile_sprite.image.get_rect()
             source_rect = ((i % TILES_PER_SIDE) * self.tile_width, (i // TILES_PER_SIDE) * self.tile_height, self.tile_width, self.tile_height)
-            tile_sprite.image.blit(self.image, (0, 0), source_rect)
+            tile_sprite.image = self.image.subsurface(source_rect)
+            tile_sprite.rect = tile_sprite.image.get_rect()
             tile_sprites.append(tile_sprite)
 
         # create the blank
         tile_sprite = pg.sprite.Sprite()
-        tile_sprite.image = pg.Surface((self.tile_width, self.tile_height))
+        tile_sprite.image = pg.Surface((self.tile_width, self.tile_height)).convert()
         tile_sprite.rect = tile_sprite.image.get_rect()
         tile_sprite.image.fill(GREY)
         tile_sprites.append(tile_sprite)
 
         return tile_sprites
 
+    def init_intro_surface(self):
+        """Create and return the surface of the splash screen."""
+
+        intro_surface = pg.Surface((self.screen_width, self.screen_height)).convert()
+        intro_surface.fill(SILVER)
+        self.draw_text(intro_surface, "PygameSlidePuzzle", 48, GREY, (self.screen_width // 2, self.screen_height // 4))
+        self.draw_text(intro_surface, "Click on a tile to move it", 24, GREY, (self.screen_width // 2, self.screen_height // 2))
+        self.draw_text(intro_surface, "Click to start playing", 24, GREY, (self.screen_width // 2, self.screen_height * 3 // 4))
+
+        return intro_surface
+
+    def init_game_over_overlay(self):
+        """Create and return the translucent surface blitted on top of the board when the game is over."""
+
+        overlay = pg.Surface((self.screen_width, self.screen_height), pg.SRCALPHA).convert_alpha()
+        overlay.fill(GREY + (200,))
+        self.draw_text(overlay, "Congratulations!", 48, SILVER, (self.screen_width // 2, self.screen_height // 2))
+        self.draw_text(overlay, "Click to play again", 24, SILVER, (self.screen_width // 2, self.screen_height * 3 // 4))
+
+        return overlay
+
     def event_get(self):
-        """Manage user input and return coordinates of the tile he wants to move (if he doesn't want to quit)."""
+        """Manage user input and return the index of the tile he wants to move (if he doesn't want to quit).
+        Sleep until an event arrives, for at most one frame, so that the program stays idle while the user is thinking."""
 
-        for event in pg.event.get():
+        event = pg.event.wait(1000 // FPS)
+        while event.type != pg.NOEVENT:
 
             if event.type == pg.QUIT:
                 self.running = False
@@ -153,44 +253,76 @@ class Game():
 
             if event.type == pg.MOUSEBUTTONDOWN:
 
-                mouse_x, mouse_y = pg.mouse.get_pos()
+                mouse_x, mouse_y = event.pos
                 board_x = mouse_x // self.tile_width
                 board_y = mouse_y // self.tile_height
-                return (board_x, board_y)
+                if board_x < TILES_PER_SIDE and board_y < TILES_PER_SIDE:
+                    return board_y * TILES_PER_SIDE + board_x
+                return None
+
+            if event.type == pg.VIDEOEXPOSE:
+                self.full_redraw = True
+                self.dirty = True
+
+            event = pg.event.poll()
 
     def update(self):
-        """Pass the move requested by the user to the Board and check if game is over."""
+        """Pass the move requested by the user to the Board and, if a tile moved, check if game is over."""
 
-        if self.command in self.board.get_valid_moves():
+        if self.command in VALID_MOVES_SETS[self.board.blank_idx]:
             self.board.move_tile(self.command)
+            self.dirty = True
 
-        if self.board.is_game_won():
-            self.game_won = True
+            if self.board.is_game_won():
+                self.game_won = True
 
     def render(self):
-        """Render the tiles onto the display surface and draw a grid on top of them. If game is over, render the relevant screen."""
-
-        if self.do_render:
-
-            self.screen.fill(GREY)
-            for row in range(TILES_PER_SIDE):
-                for col in range(TILES_PER_SIDE):
-                    coord = (col, row)
-                    tile = self.board.tiles[coord]
-                    self.screen.blit(self.tile_sprites[tile].image, (col * self.tile_width, row * self.tile_height))
-            self.draw_grid()
-            pg.display.flip()
+        """Render the changed tiles onto the display surface and draw the grid on top of them, then update only those areas of the display.
+        The background and the whole board are rendered on the first frame and after a new Board is created. Nothing is rendered if the board did not change.
+        If game is over, render the relevant screen."""
+
+        if self.do_render and self.dirty:
+
+            if self.full_redraw:
+                indexes = range(TILES_PER_SIDE * TILES_PER_SIDE)
+                blit_seq = [(self.background, (0, 0))]
+                self.dirty_rects.append(self.background.get_rect())
+                self.full_redraw = False
+            else:
+                indexes = self.board.changed_tiles
+                blit_seq = []
+                self.dirty_rects += [self.tile_rects[i] for i in indexes]
+            self.board.changed_tiles = []
+
+            tiles = self.board.get_tiles()
+            blit_seq += [(self.tile_images[tiles[i]], self.tile_positions[i]) for i in indexes]
+            blit_seq += [(self.grid_cells[i], self.tile_positions[i]) for i in indexes]
+            self.blit_sequence(blit_seq)
+
+            if self.dirty_rects:
+                pg.display.update(self.dirty_rects)
+                self.dirty_rects = []
+            self.dirty = False
 
         if self.game_won:
             self.game_over()
 
-    def draw_grid(self):
-        """Helper function to draw a grid."""
+    def blit_sequence(self, blit_seq):
+        """Helper function to blit a sequence of (surface, position) pairs on the display surface in a single call.
+        Surface.fblits is only available in recent pygame versions, so fall back to Surface.blits."""
+
+        if hasattr(self.screen, "fblits"):
+            self.screen.fblits(blit_seq)
+        else:
+            self.screen.blits(blit_seq, doreturn=False)
+
+    def draw_grid(self, surface):
+        """Helper function to draw a grid on the given surface."""
 
         for x in range(self.tile_width, self.screen_width, self.tile_width):
-            pg.draw.line(self.screen, GREY, (x, 0), (x, self.screen_height))
+            pg.draw.line(surface, GREY, (x, 0), (x, self.screen_height))
         for y in range(self.tile_height, self.screen_height, self.tile_height):
-            pg.draw.line(self.screen, GREY, (0, y), (self.screen_width, y))
+            pg.draw.line(surface, GREY, (0, y), (self.screen_width, y))
 
     def exit(self):
         """Quit pygame properly."""
@@ -200,53 +332,52 @@ class Game():
 
     def intro(self):
         """Splash screen displaying basic information for the user.
-        Wait for a click to start the game."""
+        Sleep until a click to start the game."""
 
-        self.screen.fill(SILVER)
-        self.draw_text("PygameSlidePuzzle", 48, GREY, (self.screen_width // 2, self.screen_height // 4))
-        self.draw_text("Click on a tile to move it", 24, GREY, (self.screen_width // 2, self.screen_height // 2))
-        self.draw_text("Click to start playing", 24, GREY, (self.screen_width // 2, self.screen_height * 3 // 4))
+        self.screen.blit(self.intro_surface, (0, 0))
         pg.display.flip()
 
         on_start = True
         while on_start:
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    self.running = False
-                    on_start = False
-                if event.type == pg.MOUSEBUTTONDOWN:
-                    on_start = False
+            event = pg.event.wait()
+            if event.type == pg.QUIT:
+                self.running = False
+                on_start = False
+            if event.type == pg.MOUSEBUTTONDOWN:
+                on_start = False
 
     def game_over(self):
-        """Basic game over screen. Wait for a mouse click to play again."""
-
-        overlay = pg.Surface((self.screen_width, self.screen_height))
-        overlay.fill(GREY)
-        overlay.set_alpha(200)
-        self.screen.blit(overlay, (0, 0))
-        self.draw_text("Congratulations!", 48, SILVER, (self.screen_width // 2, self.screen_height // 2))
-        self.draw_text("Click to play again", 24, SILVER, (self.screen_width // 2, self.screen_height * 3 // 4))
+        """Basic game over screen. Sleep until a mouse click to play again."""
+
+        self.screen.blit(self.game_over_overlay, (0, 0))
         pg.display.flip()
 
         waiting = True
         while waiting:
-            for event in pg.event.get():
-                if event.type == pg.QUIT:
-                    self.do_render = False
-                    self.running = False
-                    waiting = False
-
-                if event.type == pg.MOUSEBUTTONDOWN:
-                    self.board = Board()
-                    self.game_won = False
-                    waiting = False
+            event = pg.event.wait()
+            if event.type == pg.QUIT:
+                self.do_render = False
+                self.running = False
+                waiting = False
 
-    def draw_text(self, text, size, color, center_pos):
-        """Helper function for selecting size and color of text to be blitted on the display surface."""
-        font = pg.font.Font(None, size)
-        textsurf = font.render(text, True, color)
+            if event.type == pg.MOUSEBUTTONDOWN:
+                self.board = Board()
+                self.dirty = True
+                self.full_redraw = True
+                self.game_won = False
+                waiting = False
+
+    def draw_text(self, surface, text, size, color, center_pos):
+        """Helper function for selecting size and color of text to be blitted on the given surface.
+        Fonts and rendered texts are cached, so each text is only rendered once."""
+        textsurf = self.text_surfaces.get((text, size, color))
+        if textsurf is None:
+            font = self.fonts.get(size)
+            if font is None:
+                font = self.fonts[size] = pg.font.Font(None, size)
+            textsurf = self.text_surfaces[(text, size, color)] = font.render(text, True, color)
         rect = textsurf.get_rect(center=(center_pos))
-        self.screen.blit(textsurf, rect)
+        surface.blit(textsurf, rect)
 
 
 def main():
@@ -259,7 +390,6 @@ def main():
         game.command = game.event_get()
         game.update()
         game.render()
-        game.fps_clock.tick(FPS)
 
     game.exit()
 